@@ -106,6 +106,36 @@ pub struct ReplicationConfig {
     /// List of peer nodes (host:port) for replication
     #[serde(default)]
     pub peer_list: Vec<String>,
+
+    /// Whether to start a clean MQTT session on connect (default: true).
+    /// With `false` the broker keeps this client's subscription while the node
+    /// is offline and delivers the events queued meanwhile when it reconnects
+    /// under the same client ID.
+    #[serde(default = "default_clean_session")]
+    pub clean_session: bool,
+
+    /// MQTT QoS level (0, 1 or 2) for subscribing to and publishing change
+    /// events (default: 1, at-least-once)
+    #[serde(default = "default_qos")]
+    pub qos: u8,
+
+    /// Maximum number of QoS 1/2 publishes awaiting a broker ack at once
+    /// (default: 100). A larger window lets bursts of writes be published
+    /// without waiting for each ack in turn.
+    #[serde(default = "default_mqtt_max_inflight")]
+    pub mqtt_max_inflight: u16,
+}
+
+fn default_clean_session() -> bool {
+    true
+}
+
+fn default_qos() -> u8 {
+    1
+}
+
+fn default_mqtt_max_inflight() -> u16 {
+    100
 }
 
 impl Config {
@@ -157,6 +187,9 @@ impl Config {
                 client_id: "node1".to_string(),
                 client_password: None,
                 peer_list: vec![], 
+                clean_session: default_clean_session(),
+                qos: default_qos(),
+                mqtt_max_inflight: default_mqtt_max_inflight(),
             },
             sync_interval_seconds: 60,
             anti_entropy: AntiEntropyConfig {
@@ -69,6 +69,9 @@ pub struct Replicator {
 
     /// Channel carrying decoded ChangeEvents from the MQTT eventloop
     tx: broadcast::Sender<ChangeEvent>,
+
+    /// QoS used for the subscription and for published events
+    qos: QoS,
 }
 
 impl Replicator {
@@ -118,6 +121,22 @@ impl Replicator {
             config.replication.mqtt_port,
         );
         mqtt_options.set_keep_alive(Duration::from_secs(30));
+        // A persistent session (clean_session = false) lets the broker queue
+        // events for this client ID while the node is down.
+        mqtt_options.set_clean_session(config.replication.clean_session);
+
+        let qos = match config.replication.qos {
+            0 => QoS::AtMostOnce,
+            1 => QoS::AtLeastOnce,
+            2 => QoS::ExactlyOnce,
+            other => anyhow::bail!("invalid replication qos {} (expected 0, 1 or 2)", other),
+        };
+
+        let max_inflight = config.replication.mqtt_max_inflight;
+        if max_inflight == 0 {
+            anyhow::bail!("replication mqtt_max_inflight must be at least 1");
+        }
+        mqtt_options.set_inflight(max_inflight);
 
         // -----------------------------------------------------------------------------
         // Rationale (Compatibility)
@@ -135,12 +154,14 @@ impl Replicator {
             mqtt_options.set_credentials(effective_client_id.clone(), pw);
         }
         
-    // Create MQTT client and event loop
-    let (client, mut eventloop) = AsyncClient::new(mqtt_options, 10);
+        // Create MQTT client and event loop; the request queue holds at least
+        // one inflight window so bursts of publishes do not wait on it
+        let (client, mut eventloop) =
+            AsyncClient::new(mqtt_options, usize::from(max_inflight).max(10));
         
         // Subscribe to the replication topic pattern
         let topic = format!("{}/events/#", config.replication.topic_prefix);
-        client.subscribe(&topic, QoS::AtLeastOnce).await?;
+        client.subscribe(&topic, qos).await?;
 
         // Create broadcast channel and spawn the MQTT poller
         let (tx, _rx_unused) = broadcast::channel::<ChangeEvent>(1024);
@@ -171,6 +192,7 @@ impl Replicator {
             node_id: config.replication.client_id.clone(),
             codec: ChangeCodec::Cbor,
             tx,
+            qos,
         })
     }
     
@@ -253,12 +275,13 @@ impl Replicator {
         self.publish_event(ev).await
     }
 
-    /// Serialize and publish a change event to MQTT with QoS 1 (at-least-once).
+    /// Serialize and publish a change event to MQTT with the configured QoS
+    /// (at-least-once by default).
     async fn publish_event(&self, ev: ChangeEvent) -> Result<()> {
         let topic = format!("{}/events", self.topic_prefix);
         let payload = self.codec.encode(&ev).map_err(|e| anyhow::anyhow!(e))?;
         self.client
-            .publish(&topic, QoS::AtLeastOnce, false, payload)
+            .publish(&topic, self.qos, false, payload)
             .await?;
         Ok(())
     }
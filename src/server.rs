@@ -31,7 +31,7 @@ use crate::sync::SyncManager;
 use crate::protocol::{SyncOptions, ReplicateAction};     // the options parsed by SYNC (full/verify)
 use crate::store::KVEngineStoreTrait;
 use anyhow::Result;
-use log::{error, info};
+use log::{error, info, warn};
 use std::net::SocketAddr;
 use std::sync::Arc;
 use std::sync::atomic::{AtomicU64, Ordering};
@@ -409,6 +409,10 @@ impl Server {
             match listener.accept().await {
                 Ok((socket, addr)) => {
                     info!("Accepted connection from {}", addr);
+                    // Responses are small; send them without waiting on Nagle.
+                    if let Err(e) = socket.set_nodelay(true) {
+                        warn!("Failed to set TCP_NODELAY for {}: {}", addr, e);
+                    }
                     
                     // Clone the Arc for this connection
                     let store_clone = Arc::clone(&store);
@@ -0,0 +1,71 @@
+"""
+Node configuration shared by the integration tests.
+
+Node configs differ only in a handful of values, so both layouts are rendered
+from fixed templates with a single ``str.format`` rather than serialized
+through a TOML library. ``replication_config`` fills in the layout of a
+replicating node; standalone nodes use ``STANDALONE_CONFIG_TEMPLATE``.
+"""
+
+from typing import Optional, Tuple
+
+# Config of a node with replication disabled
+STANDALONE_CONFIG_TEMPLATE = """\
+host = "127.0.0.1"
+port = {port}
+storage_path = "{storage_path}"
+engine = "{engine}"
+sync_interval_seconds = 60
+
+[replication]
+enabled = false
+mqtt_broker = "localhost"
+mqtt_port = 1883
+topic_prefix = "{topic_prefix}"
+client_id = "{node_id}"
+"""
+
+# Config of a node with replication enabled; {session} holds the optional
+# persistent-session settings
+REPLICATION_CONFIG_TEMPLATE = """\
+host = "127.0.0.1"
+port = {port}
+storage_path = "{storage_path}"
+engine = "rwlock"
+sync_interval_seconds = 60
+
+[replication]
+enabled = true
+mqtt_broker = "{mqtt_broker}"
+mqtt_port = {mqtt_port}
+topic_prefix = "{topic_prefix}"
+client_id = "{client_id}"
+# Let bursts of writes publish without waiting on each ack in turn
+mqtt_max_inflight = 64
+{session}"""
+
+_PERSISTENT_SESSION = """\
+clean_session = false
+qos = 1
+"""
+
+
+def replication_config(port: int, node_id: str, topic_prefix: str, mqtt_broker: Tuple[str, int], *,
+                       storage_prefix: str = "data_test_", client_id: Optional[str] = None,
+                       persistent_session: bool = False) -> str:
+    """Render the TOML config of a node with replication enabled.
+
+    ``topic_prefix`` must be shared by every node of a test. ``client_id``
+    defaults to ``node_id``. With ``persistent_session`` the broker queues
+    events for the node while it is down.
+    """
+    broker_host, broker_port = mqtt_broker
+    return REPLICATION_CONFIG_TEMPLATE.format(
+        port=port,
+        storage_path=f"{storage_prefix}{node_id}",
+        mqtt_broker=broker_host,
+        mqtt_port=broker_port,
+        topic_prefix=topic_prefix,
+        client_id=client_id or node_id,
+        session=_PERSISTENT_SESSION if persistent_session else "",
+    )
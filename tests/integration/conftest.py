@@ -11,13 +11,15 @@ This module provides:
 
 import asyncio
 import os
+import shutil
 import signal
 import socket
 import subprocess
 import tempfile
 import time
+import uuid
 from pathlib import Path
-from typing import AsyncGenerator, Generator, Optional
+from typing import AsyncGenerator, Generator, List, Optional, Tuple, Union
 
 import pytest
 import pytest_asyncio
@@ -33,18 +35,144 @@ TEST_PORT = 7379
 TEST_STORAGE_PATH = "test_data"
 SERVER_TIMEOUT = 30  # seconds to wait for server startup
 CLIENT_TIMEOUT = 5   # seconds for client operations
+PUBLIC_MQTT_BROKER = ("test.mosquitto.org", 1883)
+# Repository root (tests/integration/ is two levels below it), independent of
+# the directory pytest is invoked from.
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+class PersistentClient:
+    """Async client that keeps one connection to a node open across commands.
+
+    Exchanges are serialized by a lock and each response is read up to its
+    CRLF terminator. The connection is opened on first use and replaced when
+    the node is seen to have closed it (for example after a restart). An
+    exchange that fails part way is never resent, since the node may already
+    have applied it.
+    """
+    
+    def __init__(self, host: str = TEST_HOST, port: int = TEST_PORT):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+    
+    async def __aenter__(self) -> "PersistentClient":
+        await self.connect()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+    
+    async def connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Return the cached connection, opening it if needed.
+
+        A cached connection the node has closed since its last use is stale:
+        nothing has been written on it yet, so it is safe to replace.
+        """
+        if self._writer is not None and (self._writer.is_closing() or self._reader.at_eof()):
+            self.reset()
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        return self._reader, self._writer
+    
+    async def execute_command(self, command: Union[str, bytes]) -> str:
+        """Send a command and return its response without the line terminator.
+
+        Polling loops may pass the command already encoded, without its CRLF.
+        """
+        if isinstance(command, str):
+            command = command.encode()
+        return (await self._exchange(command + b"\r\n", 1))[0]
+    
+    async def execute_many(self, commands: List[str]) -> List[str]:
+        """Pipeline ``commands`` and return their responses in order.
+
+        All commands are written at once and the responses read back in order,
+        so the batch costs one round trip instead of one per command.
+        """
+        payload = "".join(f"{command}\r\n" for command in commands).encode()
+        return await self._exchange(payload, len(commands))
+    
+    async def _exchange(self, payload: bytes, count: int) -> List[str]:
+        """Write ``payload`` and read ``count`` CRLF-terminated responses."""
+        async with self._lock:
+            reader, writer = await self.connect()
+            try:
+                writer.write(payload)
+                await writer.drain()
+                lines = [await reader.readuntil(b"\r\n") for _ in range(count)]
+            except BaseException:
+                # The stream may be out of step with its responses now.
+                self.reset()
+                raise
+            return [line[:-2].decode() for line in lines]
+    
+    def reset(self) -> None:
+        """Drop the connection without waiting for it to close."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+    
+    async def close(self) -> None:
+        """Close the connection."""
+        writer = self._writer
+        self.reset()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+async def wait_until(coro_factory, predicate=bool, timeout: float = 10.0, interval: float = 0.05):
+    """Await ``coro_factory()`` until ``predicate`` accepts its result.
+
+    Returns the first accepted result, or the last one once ``timeout``
+    seconds have passed so the caller's assertion can report it.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = await coro_factory()
+        if predicate(result) or time.monotonic() >= deadline:
+            return result
+        await asyncio.sleep(interval)
+
+async def wait_for_replication_ready(nodes: List[PersistentClient], timeout: float = 15.0) -> None:
+    """Wait until every node in ``nodes`` applies writes made on another node.
+
+    A node subscribes to MQTT some time after its TCP port opens, and events
+    published before then never reach it. A probe key is rewritten on the
+    preceding node until it shows up on each target in turn.
+    """
+    probe = f"ready_probe_{uuid.uuid4().hex[:8]}"
+    for source, target in zip(nodes[-1:] + nodes[:-1], nodes):
+        key = f"{probe}_{target.port}"
+        request = f"GET {key}".encode()
+
+        async def replicated():
+            await source.execute_command(f"SET {key} ready")
+            return await wait_until(lambda: target.execute_command(request),
+                                    lambda r: r == "VALUE ready", timeout=0.25)
+
+        result = await wait_until(replicated, lambda r: r == "VALUE ready", timeout=timeout)
+        assert result == "VALUE ready", f"Node {target.port} did not receive replicated writes within {timeout}s"
 
 class MerkleKVServer:
     """Manages a MerkleKV server process for testing."""
     
     def __init__(self, host: str = TEST_HOST, port: int = TEST_PORT, 
-                 storage_path: str = TEST_STORAGE_PATH, config_path: Optional[str] = None):
+                 storage_path: str = TEST_STORAGE_PATH, config_path: Optional[str] = None,
+                 binary: Optional[Path] = None):
         self.host = host
         self.port = port
         self.storage_path = storage_path
         self.custom_config_path = config_path
+        # Prebuilt server binary (see the merkle_binary fixture); without one
+        # the server is started through ``cargo run``.
+        self.binary = binary
         self.process: Optional[subprocess.Popen] = None
         self.config_file: Optional[Path] = None
+        self._client: Optional[PersistentClient] = None
         
     def create_config(self, temp_dir: Path) -> Path:
         """Create a temporary config file for the server."""
@@ -66,6 +194,12 @@ client_id = "test_node"
         config_file.write_text(config_content)
         return config_file
     
+    def _command(self) -> list[str]:
+        """Command line that runs the server with this instance's config file."""
+        if self.binary is not None:
+            return [str(self.binary), "--config", str(self.config_file)]
+        return ["cargo", "run", "--", "--config", str(self.config_file)]
+
     def start(self, temp_dir: Optional[Path] = None) -> None:
         """Start the MerkleKV server process."""
         if self.custom_config_path:
@@ -83,20 +217,14 @@ client_id = "test_node"
             storage_dir.mkdir(exist_ok=True)
         
         # Start the server process
-        cmd = ["cargo", "run", "--", "--config", str(self.config_file)]
+        cmd = self._command()
         console.print(f"[blue]Starting MerkleKV server: {' '.join(cmd)}[/blue]")
         
-        # Get the project root directory (two levels up from tests/integration)
-        project_root = Path.cwd()
-        if "tests" in str(project_root):
-            # We're running from tests directory, go up to project root
-            project_root = project_root.parent.parent
-        
         self.process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            cwd=project_root,  # Use project root
+            cwd=PROJECT_ROOT,
             env={**os.environ, "RUST_LOG": "info"}
         )
         
@@ -120,20 +248,14 @@ client_id = "test_node"
             storage_dir.mkdir(exist_ok=True)
         
         # Start the server process
-        cmd = ["cargo", "run", "--", "--config", str(self.config_file)]
+        cmd = self._command()
         console.print(f"[blue]Starting MerkleKV server: {' '.join(cmd)}[/blue]")
         
-        # Get the project root directory (two levels up from tests/integration)
-        project_root = Path.cwd()
-        if "tests" in str(project_root):
-            # We're running from tests directory, go up to project root
-            project_root = project_root.parent.parent
-        
         self.process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            cwd=project_root,  # Use project root
+            cwd=PROJECT_ROOT,
             env={**os.environ, "RUST_LOG": "info"}
         )
         
@@ -141,22 +263,16 @@ client_id = "test_node"
         await self._wait_for_server_async()
 
     async def execute_command(self, command: str) -> str:
-        """Execute a command asynchronously and return the response."""
-        reader, writer = await asyncio.open_connection(self.host, self.port)
-        
-        try:
-            # Send command
-            writer.write(f"{command}\r\n".encode())
-            await writer.drain()
-            
-            # Read response
-            data = await reader.read(1024)
-            response = data.decode().strip()
-            
-            return response
-        finally:
-            writer.close()
-            await writer.wait_closed()
+        """Execute a command asynchronously over a persistent connection.
+
+        Only the first line of the reply is returned, so this suits commands
+        with single-line replies; read multi-line ones such as STATS, INFO or
+        SCAN through MerkleKVClient. A server used this way is stopped with
+        ``stop_async``, which also closes the connection.
+        """
+        if self._client is None:
+            self._client = PersistentClient(self.host, self.port)
+        return await self._client.execute_command(command)
 
     async def is_running(self) -> bool:
         """Check if the server is running and responsive."""
@@ -166,8 +282,11 @@ client_id = "test_node"
         except:
             return False
 
-    async def stop(self) -> None:
-        """Stop the server process asynchronously."""
+    async def stop_async(self) -> None:
+        """Stop the server process asynchronously, closing the client connection."""
+        if self._client:
+            await self._client.close()
+            self._client = None
         if self.process:
             console.print("[red]Stopping MerkleKV server...[/red]")
             self.process.terminate()
@@ -276,6 +395,18 @@ client_id = "test_node"
             
             self.process = None
 
+def create_client_socket(host: str = TEST_HOST, port: int = TEST_PORT) -> socket.socket:
+    """Open a blocking client socket with Nagle's algorithm disabled.
+
+    Commands are short writes followed by a read; without TCP_NODELAY they can
+    stall on delayed ACKs. asyncio transports already set the option, and the
+    server sets it on every accepted connection.
+    """
+    sock = socket.create_connection((host, port), timeout=CLIENT_TIMEOUT)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
 class MerkleKVClient:
     """Client for interacting with MerkleKV server."""
     
@@ -286,7 +417,7 @@ class MerkleKVClient:
         
     def connect(self) -> None:
         """Connect to the server."""
-        self.socket = socket.create_connection((self.host, self.port), timeout=CLIENT_TIMEOUT)
+        self.socket = create_client_socket(self.host, self.port)
         
     def disconnect(self) -> None:
         """Disconnect from the server."""
@@ -318,14 +449,26 @@ class MerkleKVClient:
         else:
             return self.send_command(f"SET {key} {value}")
 
-    def scan(self, prefix: str) -> list[str]:
-        resp = self.send_command(f"SCAN {prefix}")
-        lines = resp.splitlines()
+    def _recv_line(self, buf: bytearray) -> str:
+        """Pop one CRLF-terminated line off ``buf``, receiving more as needed."""
+        while (end := buf.find(b"\r\n")) < 0:
+            chunk = self.socket.recv(32768)
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            buf += chunk
+        line = bytes(buf[:end])
+        del buf[:end + 2]
+        return line.decode()
 
-        if not lines:
-            return []
+    def scan(self, prefix: str) -> list[str]:
+        if not self.socket:
+            raise RuntimeError("Not connected to server")
+        self.socket.sendall(f"SCAN {prefix}\r\n".encode())
 
-        header = lines[0].strip()
+        # Read the "KEYS n" header and then exactly n key lines, however the
+        # reply is split across TCP segments.
+        buf = bytearray()
+        header = self._recv_line(buf).strip()
 
         if header.startswith("ERROR"):
             raise RuntimeError(header)
@@ -333,14 +476,14 @@ class MerkleKVClient:
             return []
 
         if not header.startswith("KEYS "):
+            lines = [header] + buf.decode().splitlines()
             return [l.strip() for l in lines if l and not l.startswith("VALUES")]
         try:
             n = int(header.split()[1])
         except (IndexError, ValueError):
             raise RuntimeError(f"Bad SCAN header: {header}")
 
-        keys = [l.strip() for l in lines[1:1 + n]]
-        return keys
+        return [self._recv_line(buf).strip() for _ in range(n)]
     
     def delete(self, key: str) -> str:
         """Delete a key."""
@@ -377,6 +520,13 @@ class MerkleKVClient:
             return self.send_command(f"PREPEND {key} {value}")
     
 
+def build_merkle_binary() -> Path:
+    """Run ``cargo build --release`` and return the path of the server binary."""
+    subprocess.run(["cargo", "build", "--release"], cwd=PROJECT_ROOT, check=True)
+    binary = PROJECT_ROOT / "target" / "release" / "merkle_kv"
+    assert binary.exists(), f"cargo build did not produce {binary}"
+    return binary
+
 @pytest.fixture(scope="session")
 def temp_test_dir() -> Generator[Path, None, None]:
     """Create a temporary directory for test data."""
@@ -384,9 +534,9 @@ def temp_test_dir() -> Generator[Path, None, None]:
         yield Path(temp_dir)
 
 @pytest.fixture
-def server(temp_test_dir: Path) -> Generator[MerkleKVServer, None, None]:
+def server(temp_test_dir: Path, merkle_binary: Path) -> Generator[MerkleKVServer, None, None]:
     """Provide a running MerkleKV server for tests."""
-    server = MerkleKVServer()
+    server = MerkleKVServer(binary=merkle_binary)
     
     try:
         server.start(temp_test_dir)
@@ -416,6 +566,113 @@ def connected_client(server: MerkleKVServer) -> Generator[MerkleKVClient, None,
     finally:
         client.disconnect()
 
+@pytest.fixture(scope="session")
+def merkle_binary() -> Path:
+    """Build the release server once per session and return its binary path.
+
+    Nodes are spawned from the binary directly instead of through
+    ``cargo run``, which re-checks the whole dependency graph on every start.
+    """
+    return build_merkle_binary()
+
+@pytest.fixture(scope="session")
+def config_dir(tmp_path_factory) -> Generator[Path, None, None]:
+    """Directory for generated node configs and logs.
+
+    Lives on tmpfs (``/dev/shm``) when the host has it, so config writes never
+    touch the disk; the directory is removed at the end of the session.
+    """
+    shm = Path("/dev/shm")
+    if not shm.is_dir():
+        yield tmp_path_factory.mktemp("configs")
+        return
+    with tempfile.TemporaryDirectory(dir=shm, prefix="merkle_kv_configs_") as temp_dir:
+        yield Path(temp_dir)
+
+def pytest_addoption(parser):
+    """Register command line options for the integration suite."""
+    parser.addoption(
+        "--external-broker", action="store_true", default=False,
+        help="run replication tests against the public test.mosquitto.org broker",
+    )
+
+def free_port() -> int:
+    """Return a TCP port on ``TEST_HOST`` that is free right now.
+
+    Tests pick their server ports this way instead of hard-coding them, so
+    parallel workers and leftover TIME_WAIT sockets from a previous run do
+    not collide.
+    """
+    with socket.socket() as sock:
+        sock.bind((TEST_HOST, 0))
+        return sock.getsockname()[1]
+
+def _port_open(host: str, port: int, timeout: float = 2.0) -> bool:
+    """Return True if something accepts TCP connections on host:port."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def wait_for_port(host: str, port: int, timeout: float = SERVER_TIMEOUT, interval: float = 0.005,
+                  max_interval: float = 0.1, process: Optional[subprocess.Popen] = None) -> bool:
+    """Poll host:port until it accepts TCP connections.
+
+    The delay between probes starts at ``interval`` and backs off to
+    ``max_interval``, so a fast start is noticed within milliseconds without
+    hammering a slow one. Returns False once ``timeout`` seconds have passed,
+    or as soon as ``process`` (the server being waited for) has exited.
+    """
+    deadline = time.monotonic() + timeout
+    while not _port_open(host, port, timeout=0.1):
+        if (process is not None and process.poll() is not None) or time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+        interval = min(interval * 1.5, max_interval)
+    return True
+
+@pytest.fixture(scope="session")
+def mqtt_broker(request, tmp_path_factory) -> Generator[Tuple[str, int], None, None]:
+    """Provide the (host, port) of the MQTT broker used for replication tests.
+
+    By default a private mosquitto is spawned on an ephemeral loopback port for
+    the session. Without a mosquitto binary an already running local broker on
+    1883 is used, and the tests are skipped when there is none.
+    ``--external-broker`` selects the public broker, as the nightly run does.
+    """
+    if request.config.getoption("--external-broker"):
+        yield PUBLIC_MQTT_BROKER
+        return
+
+    mosquitto = shutil.which("mosquitto")
+    if mosquitto is None:
+        if not _port_open(TEST_HOST, 1883):
+            pytest.skip("mosquitto not found and no MQTT broker on 127.0.0.1:1883 "
+                        "(install mosquitto or pass --external-broker)")
+        yield (TEST_HOST, 1883)
+        return
+
+    port = free_port()
+    config_file = tmp_path_factory.mktemp("mosquitto") / "mosquitto.conf"
+    config_file.write_text(f"listener {port} {TEST_HOST}\nallow_anonymous true\n")
+
+    process = subprocess.Popen(
+        [mosquitto, "-c", str(config_file)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not wait_for_port(TEST_HOST, port, timeout=10, process=process):
+            raise RuntimeError(f"mosquitto failed to start on port {port}")
+        yield (TEST_HOST, port)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
 def pytest_configure(config):
     """Configure pytest with custom markers."""
     config.addinivalue_line(
@@ -427,6 +684,9 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "integration: marks tests as integration tests"
     )
+    config.addinivalue_line(
+        "markers", "external: tests hitting the public internet (run with '-m external')"
+    )
 
 def pytest_collection_modifyitems(config, items):
     """Add markers to test items based on their names."""
@@ -435,6 +695,13 @@ def pytest_collection_modifyitems(config, items):
             item.add_marker(pytest.mark.benchmark)
         if "integration" in item.name:
             item.add_marker(pytest.mark.integration)
+    
+    # Tests on the public internet only run when a -m expression asks for them
+    if not config.getoption("markexpr"):
+        deselected = [item for item in items if item.get_closest_marker("external")]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if not item.get_closest_marker("external")]
 
 @pytest.fixture(autouse=True)
 def setup_logging():
@@ -457,8 +724,7 @@ def generate_test_data(size: int = 100) -> dict[str, str]:
 
 def connect_to_server(host: str = TEST_HOST, port: int = TEST_PORT):
     """Connect to the MerkleKV server and return a socket."""
-    sock = socket.create_connection((host, port), timeout=CLIENT_TIMEOUT)
-    return sock
+    return create_client_socket(host, port)
 
 
 def send_command(client, command: str) -> str:
@@ -474,5 +740,28 @@ def send_command(client, command: str) -> str:
     return response
 
 
+def send_pipeline(client, commands: list[str]) -> list[str]:
+    """Send ``commands`` in a single write and return their responses in order.
+
+    Every command must have a single-line response; all of them are read back
+    after the write, so the batch costs one round trip instead of one each.
+    """
+    client.sendall("".join(f"{command}\r\n" for command in commands).encode())
+    
+    buf = bytearray()
+    responses = []
+    while len(responses) < len(commands):
+        end = buf.find(b"\r\n")
+        if end < 0:
+            chunk = client.recv(65536)
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            buf += chunk
+            continue
+        responses.append(buf[:end].decode())
+        del buf[:end + 2]
+    return responses
+
+
 # Note: ReplicationTestSetup has been moved to use simple functions in test_replication.py
 # The replication_setup fixture is no longer needed
@@ -67,8 +67,8 @@ async def execute_demo_command(host: str, port: int, command: str) -> str:
         writer.write(f"{command}\r\n".encode())
         await writer.drain()
         
-        data = await reader.read(1024)
-        response = data.decode().strip()
+        line = await reader.readuntil(b"\r\n")
+        response = line[:-2].decode()
         
         writer.close()
         await writer.wait_closed()
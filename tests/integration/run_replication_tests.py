@@ -3,7 +3,9 @@
 Script to run replication tests for MerkleKV.
 
 This script provides convenient commands to test the MQTT-based replication
-functionality using the public test.mosquitto.org broker.
+functionality. The broker comes from the ``mqtt_broker`` fixture in
+conftest.py: a private mosquitto when one is installed, otherwise a local or
+the public test.mosquitto.org broker.
 """
 
 import argparse
@@ -26,9 +28,9 @@ def run_full_tests():
     return result.returncode == 0
 
 def run_connectivity_test():
-    """Run just the MQTT connectivity test."""
+    """Run the connectivity test against the public MQTT broker."""
     print("🧪 Testing MQTT broker connectivity...")
-    cmd = ["python", "-m", "pytest", "-v", "-k", "test_mqtt_broker_connectivity"]
+    cmd = ["python", "-m", "pytest", "-v", "-m", "external", "test_external_connectivity.py"]
     result = subprocess.run(cmd, cwd=Path(__file__).parent)
     return result.returncode == 0
 
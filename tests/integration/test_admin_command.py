@@ -40,6 +40,7 @@ def send_cmd(sock: socket.socket, cmd: str, multiline=False, max_lines=50, timeo
 def open_conn(host, port):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((host, port))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     return s
 
 # ---------- NEW TESTS: HASH ----------
@@ -147,6 +148,7 @@ def main():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         s.connect((args.host, args.port))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     except OSError as e:
         raise SystemExit(
             f"Cannot connect to {(args.host, args.port)}: {e}. "
@@ -182,7 +182,7 @@ class TestBasicOperations:
 class TestDataPersistence:
     """Test data persistence across server restarts."""
     
-    def test_data_survives_server_restart(self, temp_test_dir, connected_client: MerkleKVClient):
+    def test_data_survives_server_restart(self, temp_test_dir, merkle_binary, connected_client: MerkleKVClient):
         """Test that data persists when server is restarted."""
         # Set some data
         test_data = {
@@ -205,7 +205,7 @@ class TestDataPersistence:
         # Restart server with same storage path
         from conftest import MerkleKVServer
         
-        server = MerkleKVServer()
+        server = MerkleKVServer(binary=merkle_binary)
         try:
             server.start(temp_test_dir)
             
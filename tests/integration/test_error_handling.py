@@ -163,13 +163,13 @@ class TestErrorHandling:
             finally:
                 client.disconnect()
     
-    def test_server_restart_recovery(self, temp_test_dir):
+    def test_server_restart_recovery(self, temp_test_dir, merkle_binary):
         """Test client behavior when server restarts."""
         # Use absolute path for storage
         storage_path = str(temp_test_dir / "storage_data")
         
         # Start server with explicit storage path
-        server = MerkleKVServer(storage_path=storage_path)
+        server = MerkleKVServer(storage_path=storage_path, binary=merkle_binary)
         server.start(temp_test_dir)
         
         # Set some data
@@ -198,7 +198,7 @@ class TestErrorHandling:
             pass  # Expected - server should be stopped
         
         # Restart server with same storage path
-        server = MerkleKVServer(storage_path=storage_path)
+        server = MerkleKVServer(storage_path=storage_path, binary=merkle_binary)
         server.start(temp_test_dir)
         
         # Verify data is still there
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Connectivity check against the public MQTT broker.
+
+These tests reach the public internet, so they are deselected by default;
+run them with ``pytest -m external``.
+"""
+
+import asyncio
+import uuid
+
+import aiomqtt
+import pytest
+
+from conftest import PUBLIC_MQTT_BROKER
+
+pytestmark = pytest.mark.external
+
+@pytest.mark.asyncio
+async def test_mqtt_broker_connectivity():
+    """Test that we can publish to and receive from the public MQTT broker."""
+    host, port = PUBLIC_MQTT_BROKER
+    topic = f"test/merkle_kv/connectivity/{uuid.uuid4().hex[:8]}"
+
+    try:
+        async with aiomqtt.Client(host, port, timeout=10) as client:
+            await client.subscribe(topic)
+
+            # Publish a test message and wait for it to come back
+            await client.publish(topic, "test_message")
+            message = await asyncio.wait_for(anext(client.messages), timeout=5)
+            assert message.payload == b"test_message"
+
+        print(f"✅ Successfully connected to {host}:{port}")
+
+    except (aiomqtt.MqttError, asyncio.TimeoutError) as e:
+        pytest.fail(f"Failed to connect to MQTT broker: {e}")
@@ -16,6 +16,7 @@ def test_large_values():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.connect(('127.0.0.1', 7379))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
         # Test 16KB value
         large_value = 'X' * (16 * 1024)
@@ -52,6 +53,7 @@ def test_delete_semantics():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.connect(('127.0.0.1', 7379))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
         # SET k v → DEL k expects DELETED
         sock.sendall(b'SET k v\r\n')
@@ -78,6 +80,7 @@ def test_tab_handling():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.connect(('127.0.0.1', 7379))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
         # SET key "a\tb\tc" → GET key returns exactly the same
         tab_value = 'a\tb\tc'
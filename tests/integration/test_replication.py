@@ -6,28 +6,38 @@ This module tests the real-time replication of write operations across
 MerkleKV nodes using MQTT as the message transport.
 
 Test Setup:
-- Uses public MQTT broker: test.mosquitto.org:1883
+- Uses the session MQTT broker from the ``mqtt_broker`` fixture (a private
+  mosquitto on loopback; ``--external-broker`` selects test.mosquitto.org)
 - Creates multiple MerkleKV server instances
 - Verifies that write operations on one node are replicated to others
 - Tests various operations: SET, DELETE, INC, DEC, APPEND, PREPEND
 """
 
 import asyncio
+import collections
 import json
 import pytest
-import socket
+import pytest_asyncio
 import subprocess
-import tempfile
 import time
 import uuid
 from pathlib import Path
-from typing import List, Dict, Any
-import toml
-import threading
-import paho.mqtt.client as mqtt
-import base64
+from typing import List, Dict, Any, Optional, Tuple, Union
+import aiomqtt
 import os
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; stdlib json also accepts bytes
+    from json import loads as json_loads
+try:
+    from cbor2 import loads as cbor_loads
+except ImportError:  # without cbor2, binary events are recorded undecoded
+    cbor_loads = None
+
+from _config import replication_config
+from conftest import PROJECT_ROOT, PersistentClient, free_port, wait_for_replication_ready, wait_until
+
 @pytest.fixture
 def unique_topic_prefix():
     """Generate a unique topic prefix for each test to avoid interference."""
@@ -35,105 +45,122 @@ def unique_topic_prefix():
     import os
     return f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
 
-def create_simple_replication_config(port: int, node_id: str, topic_prefix: str) -> Path:
-    """Create a temporary config file with replication enabled."""
-    # Ensure unique topic prefix with timestamp but SAME for all nodes in a test
-    unique_topic = f"{topic_prefix}_{int(time.time())}"
-    
-    # Defensive CI fallback: try local broker first, then public broker
-    mqtt_broker = "127.0.0.1"
-    mqtt_port = 1883
-    
-    # Test if local MQTT broker is available
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)  # 2 second timeout
-        result = sock.connect_ex((mqtt_broker, mqtt_port))
-        sock.close()
-        if result != 0:  # Connection failed
-            mqtt_broker = "test.mosquitto.org"
-            mqtt_port = 1883
-    except Exception as e:
-        mqtt_broker = "test.mosquitto.org"
-        mqtt_port = 1883
-    
-    config = {
-        "host": "127.0.0.1",
-        "port": port,
-        "storage_path": f"data_test_{node_id}",
-        "engine": "rwlock",
-        "sync_interval_seconds": 60,
-        "replication": {
-            "enabled": True,
-            "mqtt_broker": mqtt_broker,
-            "mqtt_port": mqtt_port,
-            "topic_prefix": unique_topic,  # Same for all nodes in the test
-            "client_id": f"{node_id}_{port}"  # Ensure unique client ID
-        }
-    }
-    
-    # Create temporary config file
-    temp_config = Path(f"/tmp/config_{node_id}_{port}.toml")
-    with open(temp_config, 'w') as f:
-        toml.dump(config, f)
-    
-    return temp_config
-
-async def start_simple_server(config_path: Path, timeout: int = 30) -> subprocess.Popen:
-    """Start a MerkleKV server with the given config."""
-    cmd = ["cargo", "run", "--release", "--", "--config", str(config_path)]
+def create_simple_replication_config(port: int, node_id: str, topic_prefix: str, config_dir: Path,
+                                     mqtt_broker: Tuple[str, int], *, client_id: Optional[str] = None,
+                                     persistent_session: bool = False) -> Path:
+    """Create a config file with replication enabled inside ``config_dir``.
+
+    ``topic_prefix`` is used verbatim; callers pass a per-test unique prefix
+    and every node of a test must share it. ``mqtt_broker`` is the
+    ``(host, port)`` pair from the ``mqtt_broker`` fixture. ``client_id``
+    defaults to ``{node_id}_{port}``; a node with ``persistent_session`` keeps
+    its broker session across restarts, so give it a client ID no other test
+    can reuse.
+    """
+    # The config_dir fixture removes the directory, so the file needs no cleanup
+    config_path = config_dir / f"config_{node_id}_{port}.toml"
+    config_path.write_text(replication_config(
+        port, node_id, topic_prefix, mqtt_broker,
+        client_id=client_id or f"{node_id}_{port}",  # Ensure unique client ID
+        persistent_session=persistent_session,
+    ))
+    return config_path
+
+async def start_simple_server(merkle_binary: Path, config_path: Path, port: int, timeout: int = 30) -> subprocess.Popen:
+    """Start a MerkleKV server from the prebuilt ``merkle_binary`` with the given config."""
+    cmd = [str(merkle_binary), "--config", str(config_path)]
     print(f"Starting server: {' '.join(cmd)}")
     
-    # Get project root
-    project_root = Path.cwd()
-    if "tests" in str(project_root):
-        project_root = project_root.parent.parent
-    
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        cwd=project_root,
-        env={**os.environ, "RUST_LOG": "info"}
-    )
+    # Nothing drains the server's output while a test runs, so it must not go
+    # to a pipe: once the pipe buffer fills the server blocks on logging.
+    # Logs (stderr) go to a file next to the config instead.
+    log_path = config_path.with_suffix(".log")
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=log_file,
+            cwd=PROJECT_ROOT,
+            env={**os.environ, "RUST_LOG": "warn"}
+        )
     
     # Wait for server to start
     start_time = time.time()
-    port = None
-    
-    # Extract port from config
-    with open(config_path) as f:
-        config_data = toml.load(f)
-        port = config_data["port"]
     
+    # Poll quickly at first and back off, so a fast boot is noticed within a
+    # few milliseconds without hammering a slow one.
+    delay = 0.005
     while time.time() - start_time < timeout:
         if process.poll() is not None:
-            stdout, stderr = process.communicate()
-            raise RuntimeError(f"Server failed to start: {stderr.decode()}")
+            raise RuntimeError(
+                f"Server failed to start: {log_path.read_text(errors='replace')}"
+            )
         
         try:
-            with socket.create_connection(("127.0.0.1", port), timeout=1):
-                print(f"✅ Server started on port {port}")
-                return process
-        except (socket.timeout, ConnectionRefusedError):
-            await asyncio.sleep(0.5)
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection("127.0.0.1", port), timeout=0.1
+            )
+            writer.close()
+            await writer.wait_closed()
+            print(f"✅ Server started on port {port}")
+            return process
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 0.1)
     
     process.terminate()
     raise TimeoutError(f"Server failed to start within {timeout} seconds")
 
-async def execute_simple_command(host: str, port: int, command: str) -> str:
-    """Execute a command on the server."""
-    reader, writer = await asyncio.open_connection(host, port)
-    
-    try:
-        writer.write(f"{command}\r\n".encode())
-        await writer.drain()
-        
-        data = await reader.read(1024)
-        return data.decode().strip()
-    finally:
-        writer.close()
-        await writer.wait_closed()
+async def start_simple_servers(merkle_binary: Path, *nodes: Tuple[Path, int]) -> List[subprocess.Popen]:
+    """Start several MerkleKV servers concurrently from ``(config_path, port)`` pairs.
+
+    Startup of independent nodes overlaps, so a cluster comes up in roughly the
+    time of its slowest node. If any node fails to start, the ones that did are
+    terminated before the error is re-raised.
+    """
+    results = await asyncio.gather(
+        *(start_simple_server(merkle_binary, config_path, port) for config_path, port in nodes),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        cleanup_servers(*(r for r in results if not isinstance(r, BaseException)))
+        raise errors[0]
+    return results
+
+# One PersistentClient per node, keyed by (host, port). Tests that start their
+# own servers stop them before they finish, so the clients are closed after
+# each test by the autouse fixture below rather than at the end of the module.
+_clients: Dict[Tuple[str, int], PersistentClient] = {}
+
+def _client(host: str, port: int) -> PersistentClient:
+    """Return the client for a node, creating it on first use."""
+    client = _clients.get((host, port))
+    if client is None:
+        client = _clients[(host, port)] = PersistentClient(host, port)
+    return client
+
+async def close_clients() -> None:
+    """Close every node client."""
+    clients = list(_clients.values())
+    _clients.clear()
+    await asyncio.gather(*(client.close() for client in clients))
+
+@pytest_asyncio.fixture(autouse=True)
+async def _close_clients():
+    yield
+    await close_clients()
+
+async def execute_simple_command(host: str, port: int, command: Union[str, bytes]) -> str:
+    """Execute a command on the server over its persistent connection.
+
+    Polling loops encode their request once and pass the bytes.
+    """
+    return await _client(host, port).execute_command(command)
+
+async def execute_many(host: str, port: int, commands: List[str]) -> List[str]:
+    """Pipeline ``commands`` to the server and return their responses."""
+    return await _client(host, port).execute_many(commands)
 
 async def _eventually_get_async(port: int, key: str, expected_value: str = None, timeout_s: float = 3.0, interval_s: float = 0.05):
     """Helper to wait for eventual consistency in async context.
@@ -148,11 +175,12 @@ async def _eventually_get_async(port: int, key: str, expected_value: str = None,
     Returns:
         The response string from the server
     """
+    request = f"GET {key}".encode()
     deadline = time.time() + timeout_s
     last = None
     while time.time() < deadline:
         try:
-            last = await execute_simple_command("127.0.0.1", port, f"GET {key}")
+            last = await execute_simple_command("127.0.0.1", port, request)
             if expected_value is not None:
                 # Wait for specific value
                 if last == expected_value:
@@ -178,11 +206,12 @@ async def _eventually_get_deleted_async(port: int, key: str, timeout_s: float =
     Returns:
         The response string from the server
     """
+    request = f"GET {key}".encode()
     deadline = time.time() + timeout_s
     last = None
     while time.time() < deadline:
         try:
-            last = await execute_simple_command("127.0.0.1", port, f"GET {key}")
+            last = await execute_simple_command("127.0.0.1", port, request)
             if last == "NOT_FOUND":
                 return last
         except Exception:
@@ -190,22 +219,22 @@ async def _eventually_get_deleted_async(port: int, key: str, timeout_s: float =
         await asyncio.sleep(interval_s)
     return last
 
-def _eventually_get(port: int, key: str, timeout_s: float = 1.5, interval_s: float = 0.05):
-    """Wait for eventual consistency in replication tests."""
-    deadline = time.time() + timeout_s
-    last = None
-    while time.time() < deadline:
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            last = loop.run_until_complete(execute_simple_command("127.0.0.1", port, f"GET {key}"))
-            loop.close()
-            if last != "NOT_FOUND" and not last.startswith("ERROR"):
-                return last
-        except Exception:
-            pass
-        time.sleep(interval_s)
-    return last
+async def wait_for_publishing(port: int, monitor: "MQTTTestClient", timeout: float = 15.0) -> None:
+    """Wait until ``monitor`` sees an event published by the node on ``port``.
+
+    The node subscribes before its first publish on the same MQTT connection,
+    so a delivered event also means the node's own subscription is active.
+    The probe events are discarded afterwards.
+    """
+    key = f"ready_probe_{uuid.uuid4().hex[:8]}"
+
+    async def published():
+        await execute_simple_command("127.0.0.1", port, f"SET {key} ready")
+        return await monitor.wait_for_messages(1, timeout=0.25)
+
+    count = await wait_until(published, timeout=timeout)
+    assert count, f"Node {port} published no replication events within {timeout}s"
+    monitor.reset()
 
 def cleanup_servers(*servers):
     """Clean up server processes."""
@@ -217,359 +246,331 @@ def cleanup_servers(*servers):
             except subprocess.TimeoutExpired:
                 server.kill()
 
-async def create_replication_config(port: int, node_id: str, topic_prefix: str) -> Path:
-    """Create a temporary config file with replication enabled (legacy function for compatibility)."""
-    return create_simple_replication_config(port, node_id, topic_prefix)
+class ReplicationCluster:
+    """Replicating nodes shared by the tests of this module.
 
-class MQTTTestClient:
-    """Test client to monitor MQTT messages."""
+    Nodes are started on first use and kept running until the module
+    finishes, so most tests pay neither process startup nor MQTT connection
+    setup. Tests isolate themselves by truncating the nodes and using their
+    own keys.
+    """
     
-    def __init__(self, topic_prefix: str):
-        self.topic_prefix = topic_prefix
-        self.received_messages = []
-        self.connected = threading.Event()
-        
-    def on_connect(self, client, userdata, flags, rc, properties=None):
-        if rc == 0:
-            self.connected.set()
-            topic = f"{self.topic_prefix}/events/#"
-            client.subscribe(topic)
-            
-    def on_message(self, client, userdata, msg):
+    def __init__(self, merkle_binary: Path, mqtt_broker: Tuple[str, int], config_dir: Path):
+        self.merkle_binary = merkle_binary
+        self.mqtt_broker = mqtt_broker
+        self.config_dir = config_dir
+        self.topic_prefix = f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        self.ports: List[int] = []
+        self.servers: List[subprocess.Popen] = []
+    
+    async def nodes(self, count: int) -> List[int]:
+        """Return the ports of the first ``count`` nodes, starting missing ones."""
+        if len(self.ports) < count:
+            ports = [free_port() for _ in range(len(self.ports), count)]
+            configs = [
+                create_simple_replication_config(port, f"node{index}",
+                                                 self.topic_prefix, self.config_dir, self.mqtt_broker)
+                for index, port in enumerate(ports, start=len(self.ports) + 1)
+            ]
+            self.servers += await start_simple_servers(self.merkle_binary, *zip(configs, ports))
+            self.ports += ports
+            await wait_for_replication_ready([_client("127.0.0.1", port) for port in self.ports])
+        return self.ports[:count]
+    
+    async def fresh(self, count: int) -> List[int]:
+        """Like ``nodes``, with every running node truncated first.
+
+        TRUNCATE is not replicated, so each node is cleared individually.
+        """
+        ports = await self.nodes(count)
+        results = await asyncio.gather(*[
+            execute_simple_command("127.0.0.1", port, "TRUNCATE") for port in self.ports
+        ])
+        assert results == ["OK"] * len(self.ports), f"TRUNCATE failed: {results}"
+        return ports
+    
+    def stop(self) -> None:
+        cleanup_servers(*self.servers)
+
+@pytest.fixture(scope="module")
+def replication_cluster(config_dir, mqtt_broker, merkle_binary):
+    """Module-wide replication cluster."""
+    cluster = ReplicationCluster(merkle_binary, mqtt_broker, config_dir)
+    yield cluster
+    cluster.stop()
+
+@pytest_asyncio.fixture
+async def fresh_nodes(replication_cluster):
+    """Ports of two empty nodes from the shared cluster."""
+    return await replication_cluster.fresh(2)
+
+def _decode_event_payload(payload: bytes) -> Any:
+    """Decode a replication event, choosing the codec from its first byte.
+
+    JSON (the legacy format) starts with ``{`` or ``[``; anything else is
+    treated as CBOR, the server default. Payloads that fail to decode, or CBOR
+    when cbor2 is not installed, are returned as raw bytes.
+    """
+    try:
+        if payload[:1] in (b"{", b"["):
+            return json_loads(payload)
+        if cbor_loads is not None:
+            return cbor_loads(payload)
+    except ValueError:
+        pass
+    return payload
+
+@pytest.fixture(scope="module")
+def event_loop():
+    """One event loop for the whole module, so async module fixtures such as
+    ``mqtt_monitor`` can be shared by its tests."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+class MQTTMonitor:
+    """One broker connection shared by every MQTTTestClient of the module.
+
+    A single background task reads the connection and hands each message to
+    the client subscribed to its topic.
+    """
+    
+    def __init__(self, hostname: str, port: int):
+        self._client = aiomqtt.Client(hostname, port, timeout=10)
+        self._views: Dict[str, "MQTTTestClient"] = {}
+        self._dispatch_task = None
+
+    async def start(self) -> None:
         try:
-            # Try to decode as JSON first (legacy format)
-            payload = msg.payload.decode("utf-8")
-            data = json.loads(payload)
-            self.received_messages.append({
-                'topic': msg.topic,
-                'payload': data,
-                'timestamp': time.time()
-            })
-        except (UnicodeDecodeError, json.JSONDecodeError):
-            # Handle binary format (CBOR) or malformed data gracefully
-            pass
-        
-    async def monitor_replication_messages(self, duration: float = 5.0):
-        """Monitor MQTT messages for a specified duration."""
+            await self._client.__aenter__()
+        except aiomqtt.MqttError as e:
+            pytest.skip(f"MQTT broker not reachable for monitoring: {e}")
+        self._dispatch_task = asyncio.create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        self._dispatch_task.cancel()
         try:
-            client = mqtt.Client(protocol=mqtt.MQTTv5)
-            client.on_connect = self.on_connect
-            client.on_message = self.on_message
-            
-            client.connect("test.mosquitto.org", 1883, 60)
-            client.loop_start()
-            
-            # Wait for connection
-            if self.connected.wait(timeout=10):
-                # Monitor for the specified duration
-                await asyncio.sleep(duration)
-            
-            client.loop_stop()
-            client.disconnect()
-                        
-        except Exception as e:
-            print(f"MQTT monitoring error: {e}")
+            await self._dispatch_task
+        except asyncio.CancelledError:
+            pass
+        await self._client.__aexit__(None, None, None)
+
+    async def subscribe(self, view: "MQTTTestClient") -> None:
+        """Route messages on ``view.topic`` to ``view`` once the broker acks."""
+        self._views[view.topic] = view
+        await self._client.subscribe(view.topic)
+
+    async def unsubscribe(self, view: "MQTTTestClient") -> None:
+        self._views.pop(view.topic, None)
+        await self._client.unsubscribe(view.topic)
+
+    async def _dispatch(self):
+        async for msg in self._client.messages:
+            view = self._views.get(str(msg.topic))
+            if view is not None:
+                view.record(msg)
+
+@pytest_asyncio.fixture(scope="module")
+async def mqtt_monitor(mqtt_broker):
+    """Module-wide MQTT connection backing every MQTTTestClient."""
+    monitor = MQTTMonitor(*mqtt_broker)
+    await monitor.start()
+    yield monitor
+    await monitor.stop()
+
+class MQTTTestClient:
+    """Async context manager that records replication events for a topic prefix.
+
+    A view over the shared ``mqtt_monitor`` connection: it subscribes to the
+    prefix's event topic on entry and unsubscribes on exit, so tests pay for a
+    SUBSCRIBE rather than a full CONNECT. Only the last ``MAX_KEPT_MESSAGES``
+    are kept in ``received_messages``; ``message_count`` counts them all.
+    """
+    
+    MAX_KEPT_MESSAGES = 256
+    
+    def __init__(self, topic_prefix: str, monitor: MQTTMonitor):
+        self.topic_prefix = topic_prefix
+        # Nodes publish every event on this one topic, so no wildcard is needed
+        self.topic = f"{topic_prefix}/events"
+        self.received_messages = collections.deque(maxlen=self.MAX_KEPT_MESSAGES)
+        self.message_count = 0
+        # Set on every recorded message; wait_for_messages() clears it
+        self._message_event = asyncio.Event()
+        self._monitor = monitor
+
+    async def __aenter__(self):
+        await self._monitor.subscribe(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._monitor.unsubscribe(self)
+
+    def record(self, msg: aiomqtt.Message) -> None:
+        """Record a message delivered on this client's topic."""
+        self.received_messages.append({
+            'topic': str(msg.topic),
+            'payload': _decode_event_payload(msg.payload),
+            'timestamp': time.monotonic_ns()
+        })
+        self.message_count += 1
+        self._message_event.set()
+
+    async def wait_for_messages(self, n: int, timeout: float) -> int:
+        """Wait until at least ``n`` messages were recorded or ``timeout`` expires.
+
+        Returns the number of recorded messages, which is below ``n`` on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while self.message_count < n:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._message_event.clear()
+            try:
+                await asyncio.wait_for(self._message_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.message_count
+
+    def reset(self) -> None:
+        """Forget every message recorded so far."""
+        self.received_messages.clear()
+        self.message_count = 0
 
 @pytest.mark.asyncio
-async def test_basic_replication_setup():
+async def test_basic_replication_setup(fresh_nodes):
     """Test that replication nodes can be created and connected."""
-    import os
-    topic_prefix = f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    port1, port2 = fresh_nodes
     
-    # Create configs for two nodes
-    config1 = create_simple_replication_config(7380, "node1", topic_prefix)
-    config2 = create_simple_replication_config(7381, "node2", topic_prefix)
+    # Basic connectivity test
+    result = await execute_simple_command("127.0.0.1", port1, "SET test_key test_value")
+    assert result == "OK"
     
-    server1 = None
-    server2 = None
+    response = await execute_simple_command("127.0.0.1", port1, "GET test_key")
+    assert response == "VALUE test_value"
     
-    try:
-        # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
-        
-        # Wait for MQTT connections
-        await asyncio.sleep(5)
-        
-        # Basic connectivity test
-        result = await execute_simple_command("127.0.0.1", 7380, "SET test_key test_value")
-        assert result == "OK"
-        
-        response = await execute_simple_command("127.0.0.1", 7380, "GET test_key")
-        assert response == "VALUE test_value"
-        
-        print("✅ Basic replication setup test passed")
-        
-    finally:
-        cleanup_servers(server1, server2)
-        # Clean up config files
-        for config_file in [config1, config2]:
-            if config_file.exists():
-                config_file.unlink()
+    print("✅ Basic replication setup test passed")
 
 @pytest.mark.asyncio
-async def test_set_operation_replication(unique_topic_prefix):
-    """Test that SET operations are replicated between nodes."""
-    # Create configs for two nodes
-    config1 = create_simple_replication_config(7382, "node1", unique_topic_prefix)
-    config2 = create_simple_replication_config(7383, "node2", unique_topic_prefix)
+@pytest.mark.parametrize(
+    "initial,mutation,mutation_result,expected",
+    [
+        pytest.param(None, "SET {key} replicated_value", "OK", "VALUE replicated_value", id="set"),
+        pytest.param("10", "INC {key}", "VALUE 11", "VALUE 11", id="inc"),
+        pytest.param("hello", "APPEND {key} _world", "VALUE hello_world", "VALUE hello_world", id="append"),
+    ],
+)
+async def test_write_operation_replication(fresh_nodes, initial, mutation, mutation_result, expected):
+    """Test that SET, INC and APPEND operations are replicated between nodes.
+
+    When ``initial`` is given the key is seeded with it (and its replication
+    confirmed) before ``mutation`` is applied on node1.
+    """
+    port1, port2 = fresh_nodes
     
-    server1 = None
-    server2 = None
+    test_key = f"repl_test_{uuid.uuid4().hex[:8]}"
     
-    try:
-        # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
-        
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(8)
-        
-        # Perform SET operation on node1
-        test_key = f"repl_test_{uuid.uuid4().hex[:8]}"
-        test_value = "replicated_value"
-        
-        result = await execute_simple_command("127.0.0.1", 7382, f"SET {test_key} {test_value}")
+    if initial is not None:
+        # Seed the key and wait for it to reach node2
+        result = await execute_simple_command("127.0.0.1", port1, f"SET {test_key} {initial}")
         assert result == "OK"
         
-        # Wait for replication to occur with eventual consistency
-        result = await _eventually_get_async(7383, test_key, f"VALUE {test_value}")
-        assert result == f"VALUE {test_value}", f"Expected VALUE {test_value}, got {result}"
-        
-        print(f"✅ SET replication test passed: {test_key} = {test_value}")
-        
-    finally:
-        cleanup_servers(server1, server2)
-        # Clean up config files
-        for config_file in [config1, config2]:
-            if config_file.exists():
-                config_file.unlink()
-
-@pytest.mark.asyncio
-async def test_delete_operation_replication(unique_topic_prefix):
-    """Test that DELETE operations are replicated between nodes."""
-    # Create configs for two nodes
-    config1 = create_simple_replication_config(7384, "node1", unique_topic_prefix)
-    config2 = create_simple_replication_config(7385, "node2", unique_topic_prefix)
+        result2 = await _eventually_get_async(port2, test_key, f"VALUE {initial}")
+        assert result2 == f"VALUE {initial}"
     
-    server1 = None
-    server2 = None
+    # Apply the operation on node1
+    result = await execute_simple_command("127.0.0.1", port1, mutation.format(key=test_key))
+    assert result == mutation_result
     
-    try:
-        # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
-        
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(5)
-        
-        test_key = f"delete_test_{uuid.uuid4().hex[:8]}"
-        
-        # Set initial value on node1
-        result = await execute_simple_command("127.0.0.1", 7384, f"SET {test_key} initial_value")
-        assert result == "OK"
-        
-        # Wait for replication with eventual consistency
-        result2 = await _eventually_get_async(7385, test_key, "VALUE initial_value")
-        assert result2 == "VALUE initial_value"
-        
-        # Verify both nodes have the value
-        result1 = await execute_simple_command("127.0.0.1", 7384, f"GET {test_key}")
-        assert result1 == "VALUE initial_value"
-        
-        # Delete from node1
-        result = await execute_simple_command("127.0.0.1", 7384, f"DEL {test_key}")
-        assert result == "DELETED"  # Key exists, so expect DELETED
-        
-        # Wait for deletion replication with eventual consistency
-        result2 = await _eventually_get_deleted_async(7385, test_key)
-        assert result2 == "NOT_FOUND", f"Expected NOT_FOUND, got {result2}"
-        
-        print(f"✅ DELETE replication test passed: {test_key}")
-        
-    finally:
-        cleanup_servers(server1, server2)
-        # Clean up config files
-        for config_file in [config1, config2]:
-            if config_file.exists():
-                config_file.unlink()
+    # Verify the result replicated to node2 with eventual consistency
+    result2 = await _eventually_get_async(port2, test_key, expected)
+    assert result2 == expected, f"Expected {expected}, got {result2}"
+    
+    print(f"✅ {mutation.split()[0]} replication test passed: {test_key}")
 
 @pytest.mark.asyncio
-async def test_numeric_operations_replication():
-    """Test that INC/DEC operations are replicated between nodes."""
-    import os
-    topic_prefix = f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+async def test_delete_operation_replication(fresh_nodes):
+    """Test that DELETE operations are replicated between nodes."""
+    port1, port2 = fresh_nodes
     
-    # Create configs for two nodes
-    config1 = create_simple_replication_config(7386, "node1", topic_prefix)
-    config2 = create_simple_replication_config(7387, "node2", topic_prefix)
+    test_key = f"delete_test_{uuid.uuid4().hex[:8]}"
     
-    server1 = None
-    server2 = None
+    # Set initial value on node1
+    result = await execute_simple_command("127.0.0.1", port1, f"SET {test_key} initial_value")
+    assert result == "OK"
     
-    try:
-        # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
-        
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(5)
-        
-        test_key = f"numeric_test_{uuid.uuid4().hex[:8]}"
-        
-        # Initialize with a numeric value
-        result = await execute_simple_command("127.0.0.1", 7386, f"SET {test_key} 10")
-        assert result == "OK"
-        
-        # Wait for replication with eventual consistency
-        result2 = await _eventually_get_async(7387, test_key, "VALUE 10")
-        assert result2 == "VALUE 10"
-        
-        # Verify initial value on both nodes
-        result1 = await execute_simple_command("127.0.0.1", 7386, f"GET {test_key}")
-        assert result1 == "VALUE 10"
-        
-        # Increment on node1
-        result = await execute_simple_command("127.0.0.1", 7386, f"INC {test_key}")
-        assert result == "VALUE 11"
-        
-        # Verify increment replicated to node2 with eventual consistency
-        result2 = await _eventually_get_async(7387, test_key, "VALUE 11")
-        assert result2 == "VALUE 11", f"Expected VALUE 11, got {result2}"
-        
-        print(f"✅ INC replication test passed: {test_key}")
-        
-    finally:
-        cleanup_servers(server1, server2)
-        # Clean up config files
-        for config_file in [config1, config2]:
-            if config_file.exists():
-                config_file.unlink()
-
-@pytest.mark.asyncio
-async def test_string_operations_replication():
-    """Test that APPEND/PREPEND operations are replicated between nodes."""
-    import os
-    topic_prefix = f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    # Wait for replication with eventual consistency
+    result2 = await _eventually_get_async(port2, test_key, "VALUE initial_value")
+    assert result2 == "VALUE initial_value"
     
-    # Create configs for two nodes
-    config1 = create_simple_replication_config(7388, "node1", topic_prefix)
-    config2 = create_simple_replication_config(7389, "node2", topic_prefix)
+    # Verify both nodes have the value
+    result1 = await execute_simple_command("127.0.0.1", port1, f"GET {test_key}")
+    assert result1 == "VALUE initial_value"
     
-    server1 = None
-    server2 = None
+    # Delete from node1
+    result = await execute_simple_command("127.0.0.1", port1, f"DEL {test_key}")
+    assert result == "DELETED"  # Key exists, so expect DELETED
     
-    try:
-        # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
-        
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(5)
-        
-        test_key = f"string_test_{uuid.uuid4().hex[:8]}"
-        
-        # Set initial value
-        result = await execute_simple_command("127.0.0.1", 7388, f"SET {test_key} hello")
-        assert result == "OK"
-        
-        # Wait for replication with eventual consistency
-        result2 = await _eventually_get_async(7389, test_key, "VALUE hello")
-        assert result2 == "VALUE hello"
-        
-        # Verify initial value on both nodes
-        result1 = await execute_simple_command("127.0.0.1", 7388, f"GET {test_key}")
-        assert result1 == "VALUE hello"
-        
-        # Append on node1
-        result = await execute_simple_command("127.0.0.1", 7388, f"APPEND {test_key} _world")
-        assert "hello_world" in result
-        
-        # Verify append replicated to node2 with eventual consistency
-        result2 = await _eventually_get_async(7389, test_key, "VALUE hello_world")
-        assert result2 == "VALUE hello_world", f"Expected VALUE hello_world, got {result2}"
-        
-        print(f"✅ APPEND replication test passed: {test_key}")
-        
-    finally:
-        cleanup_servers(server1, server2)
-        # Clean up config files
-        for config_file in [config1, config2]:
-            if config_file.exists():
-                config_file.unlink()
+    # Wait for deletion replication with eventual consistency
+    result2 = await _eventually_get_deleted_async(port2, test_key)
+    assert result2 == "NOT_FOUND", f"Expected NOT_FOUND, got {result2}"
+    
+    print(f"✅ DELETE replication test passed: {test_key}")
 
 @pytest.mark.asyncio
-async def test_concurrent_operations_replication():
+async def test_concurrent_operations_replication(replication_cluster):
     """Test replication behavior with concurrent operations on multiple nodes."""
-    import os
-    topic_prefix = f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    # The third node is added to the shared cluster on first use
+    port1, port2, port3 = await replication_cluster.fresh(3)
+    
+    # Perform concurrent operations
+    await asyncio.gather(
+        execute_simple_command("127.0.0.1", port1, "SET concurrent_test1 value1"),
+        execute_simple_command("127.0.0.1", port2, "SET concurrent_test2 value2"),
+        execute_simple_command("127.0.0.1", port3, "SET concurrent_test3 value3"),
+    )
     
-    # Create configs for three nodes
-    config1 = create_simple_replication_config(7390, "node1", topic_prefix)
-    config2 = create_simple_replication_config(7391, "node2", topic_prefix)
-    config3 = create_simple_replication_config(7392, "node3", topic_prefix)
+    # Verify all values are present on all nodes with eventual consistency;
+    # each poll pipelines the three GETs for a node in one round trip
+    nodes_ports = [port1, port2, port3]
+    gets = [f"GET concurrent_test{i}" for i in (1, 2, 3)]
+    expected = [f"VALUE value{i}" for i in (1, 2, 3)]
+    results = await asyncio.gather(*[
+        wait_until(
+            lambda port=port: execute_many("127.0.0.1", port, gets),
+            lambda responses: responses == expected,
+            timeout=3.0,
+        )
+        for port in nodes_ports
+    ])
     
-    server1 = None
-    server2 = None
-    server3 = None
+    for port, responses in zip(nodes_ports, results):
+        assert responses == expected, f"Node {port} has {responses}, expected {expected}"
     
-    try:
-        # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
-        server3 = await start_simple_server(config3)
-        
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(10)
-        
-        # Perform concurrent operations
-        await asyncio.gather(
-            execute_simple_command("127.0.0.1", 7390, "SET concurrent_test1 value1"),
-            execute_simple_command("127.0.0.1", 7391, "SET concurrent_test2 value2"),
-            execute_simple_command("127.0.0.1", 7392, "SET concurrent_test3 value3"),
-        )
-        
-        # Verify all values are present on all nodes with eventual consistency
-        nodes_ports = [7390, 7391, 7392]
-        for port in nodes_ports:
-            result1 = await _eventually_get_async(port, "concurrent_test1", "VALUE value1")
-            result2 = await _eventually_get_async(port, "concurrent_test2", "VALUE value2")
-            result3 = await _eventually_get_async(port, "concurrent_test3", "VALUE value3")
-            
-            assert result1 == "VALUE value1", f"Node {port} missing concurrent_test1: {result1}"
-            assert result2 == "VALUE value2", f"Node {port} missing concurrent_test2: {result2}"
-            assert result3 == "VALUE value3", f"Node {port} missing concurrent_test3: {result3}"
-        
-        print("✅ Concurrent operations replication test passed")
-        
-    finally:
-        cleanup_servers(server1, server2, server3)
-        # Clean up config files
-        for config_file in [config1, config2, config3]:
-            if config_file.exists():
-                config_file.unlink()
-
-@pytest.mark.skip(reason="Node restart test requires persistent storage which is not implemented. "
-                         "Current in-memory storage loses data on restart. "
-                         "Core replication functionality works for running nodes.")
+    print("✅ Concurrent operations replication test passed")
+
 @pytest.mark.asyncio
-async def test_replication_with_node_restart():
+async def test_replication_with_node_restart(config_dir, mqtt_broker, merkle_binary):
     """Test replication behavior when a node is restarted.
     
-    SKIPPED: This test is skipped because the current implementation uses
-    in-memory storage which doesn't persist across restarts. This is a
-    known limitation. The test would require implementing persistent storage
-    to pass, which is beyond the scope of MQTT replication testing.
-    
-    Core replication functionality (8/9 tests) works correctly for
-    running nodes. This test documents the restart limitation.
+    Both nodes connect with a persistent MQTT session (``clean_session = false``),
+    so writes made while node2 is down are queued by the broker and delivered
+    when it reconnects under the same client ID. Data node2 held before the
+    restart is lost, because the rwlock engine keeps it in memory only.
     """
     import os
     topic_prefix = f"test_merkle_kv_{os.getpid()}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
     
-    # Create configs for two nodes
-    config1 = create_simple_replication_config(7393, "node1", topic_prefix)
-    config2 = create_simple_replication_config(7394, "node2", topic_prefix)
+    port1, port2 = free_port(), free_port()
+    
+    # Create configs for two nodes. Their sessions outlive the test, so the
+    # client IDs carry a per-test suffix that a reused port cannot collide with.
+    suffix = uuid.uuid4().hex[:8]
+    config1 = create_simple_replication_config(port1, "node1", topic_prefix, config_dir, mqtt_broker,
+                                               client_id=f"node1_{port1}_{suffix}", persistent_session=True)
+    config2 = create_simple_replication_config(port2, "node2", topic_prefix, config_dir, mqtt_broker,
+                                               client_id=f"node2_{port2}_{suffix}", persistent_session=True)
     
     server1 = None
     server2 = None
@@ -577,162 +578,153 @@ async def test_replication_with_node_restart():
     
     try:
         # Start servers
-        server1 = await start_simple_server(config1)
-        server2 = await start_simple_server(config2)
+        server1, server2 = await start_simple_servers(merkle_binary, (config1, port1), (config2, port2))
         
         # Wait for MQTT connections to stabilize
-        await asyncio.sleep(10)
+        await wait_for_replication_ready([_client("127.0.0.1", port1), _client("127.0.0.1", port2)])
         
         # Set some initial data and verify replication works
-        result = await execute_simple_command("127.0.0.1", 7393, "SET restart_test1 before_restart")
+        result = await execute_simple_command("127.0.0.1", port1, "SET restart_test1 before_restart")
         assert result == "OK"
         
         # Wait for replication with eventual consistency
-        result = await _eventually_get_async(7394, "restart_test1", "VALUE before_restart")
+        result = await _eventually_get_async(port2, "restart_test1", "VALUE before_restart")
         assert result == "VALUE before_restart"
         
         # Stop node2
         cleanup_servers(server2)
         server2 = None
         
-        # Add data while node2 is down (this WON'T be available to restarted node)
-        result = await execute_simple_command("127.0.0.1", 7393, "SET restart_test2 during_downtime")
+        # Add data while node2 is down; the broker queues it for node2's session
+        result = await execute_simple_command("127.0.0.1", port1, "SET restart_test2 during_downtime")
         assert result == "OK"
         
-        await asyncio.sleep(2)
-        
         # Restart node2 (reusing same port and config to simulate actual restart)
-        server2_restarted = await start_simple_server(config2)
+        server2_restarted = await start_simple_server(merkle_binary, config2, port2)
         
         # Wait for MQTT reconnection and subscription
-        await asyncio.sleep(10)
+        await wait_for_replication_ready([_client("127.0.0.1", port1), _client("127.0.0.1", port2)])
         
         # Add data AFTER restart - this should replicate to the restarted node
-        result = await execute_simple_command("127.0.0.1", 7393, "SET restart_test3 after_restart")
+        result = await execute_simple_command("127.0.0.1", port1, "SET restart_test3 after_restart")
         assert result == "OK"
         
         # Verify new data is replicated to restarted node with eventual consistency
-        result = await _eventually_get_async(7394, "restart_test3", "VALUE after_restart")
+        result = await _eventually_get_async(port2, "restart_test3", "VALUE after_restart")
         assert result == "VALUE after_restart"
         
-        # The following assertion would fail due to in-memory storage limitation:
-        # result = await _eventually_get_async(7394, "restart_test1", "VALUE before_restart")
-        # assert result == "VALUE before_restart"  # FAILS: data lost on restart
+        # The write made during downtime was delivered from the persistent session
+        result = await _eventually_get_async(port2, "restart_test2", "VALUE during_downtime")
+        assert result == "VALUE during_downtime"
         
-        print("✅ Node restart replication test passed (new operations after restart)")
+        # Not asserted: restart_test1 is lost with node2's in-memory storage
+        
+        print("✅ Node restart replication test passed (downtime and post-restart writes)")
         
     finally:
         cleanup_servers(server1, server2, server2_restarted)
-        # Clean up config files
-        for config_file in [config1, config2]:
-            if config_file.exists():
-                config_file.unlink()
 
 @pytest.mark.asyncio
-async def test_replication_loop_prevention(unique_topic_prefix):
+async def test_replication_loop_prevention(unique_topic_prefix, config_dir, mqtt_broker, mqtt_monitor, merkle_binary):
     """Test that nodes don't create infinite loops by processing their own messages."""
+    port1 = free_port()
+    
     # Create a single node
-    config1 = create_simple_replication_config(7396, "node1", unique_topic_prefix)
+    config1 = create_simple_replication_config(port1, "node1", unique_topic_prefix, config_dir, mqtt_broker)
     
     server1 = None
     
     try:
         # Start server
-        server1 = await start_simple_server(config1)
+        server1 = await start_simple_server(merkle_binary, config1, port1)
         
         # Start MQTT monitoring
-        mqtt_client = MQTTTestClient(unique_topic_prefix)
-        monitor_task = asyncio.create_task(
-            mqtt_client.monitor_replication_messages(15.0)
-        )
-        
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(5)
-        
-        # Perform multiple operations rapidly
-        for i in range(5):
-            result = await execute_simple_command("127.0.0.1", 7396, f"SET loop_test_{i} value_{i}")
-            assert result == "OK"
-            await asyncio.sleep(0.5)
-        
-        # Wait for all messages to be processed
-        await asyncio.sleep(5)
-        
-        # Stop monitoring
-        monitor_task.cancel()
-        try:
-            await monitor_task
-        except asyncio.CancelledError:
-            pass
-        
-        # Verify we don't have an excessive number of messages (indicating loops)
-        # We should have roughly 5 messages, not 50+ from loops
-        message_count = len(mqtt_client.received_messages)
-        assert message_count <= 20, f"Too many messages detected ({message_count}), possible loop"
+        async with MQTTTestClient(unique_topic_prefix, mqtt_monitor) as mqtt_client:
+            # Wait for MQTT connections to stabilize
+            await wait_for_publishing(port1, mqtt_client)
+            
+            # Perform multiple operations concurrently, each on its own
+            # connection so the node handles them in parallel
+            clients = [PersistentClient("127.0.0.1", port1) for _ in range(5)]
+            try:
+                await asyncio.gather(*(client.connect() for client in clients))
+                started = time.monotonic()
+                results = await asyncio.gather(*[
+                    client.execute_command(f"SET loop_test_{i} value_{i}")
+                    for i, client in enumerate(clients)
+                ])
+                assert results == ["OK"] * 5
+                
+                # Time until all five events reached the broker's subscribers (at
+                # most 5s); with a wide inflight window they are not held back
+                # waiting on each other's acks
+                delivered = await mqtt_client.wait_for_messages(5, timeout=5)
+                elapsed = time.monotonic() - started
+            finally:
+                await asyncio.gather(*(client.close() for client in clients))
+            assert delivered >= 5, f"Only {delivered} of 5 events were published"
+            assert elapsed < 0.5, f"5 concurrent SETs took {elapsed:.3f}s to reach the broker's subscribers"
+            
+            # Give a looping node one more broker round trip to echo them back
+            await asyncio.sleep(1)
+            
+            # Verify we don't have an excessive number of messages (indicating loops)
+            # We should have roughly 5 messages, not 50+ from loops
+            message_count = mqtt_client.message_count
+            assert message_count <= 20, f"Too many messages detected ({message_count}), possible loop"
         
         print(f"✅ Loop prevention test passed: {message_count} messages for 5 operations")
         
     finally:
         cleanup_servers(server1)
-        # Clean up config files
-        if config1.exists():
-            config1.unlink()
 
 @pytest.mark.asyncio
-async def test_malformed_mqtt_message_handling(unique_topic_prefix):
+async def test_malformed_mqtt_message_handling(unique_topic_prefix, config_dir, mqtt_broker, mqtt_monitor, merkle_binary):
     """Test that nodes handle malformed MQTT messages gracefully."""
+    port1 = free_port()
+    
     # Create a node
-    config1 = create_simple_replication_config(7397, "node1", unique_topic_prefix)
+    config1 = create_simple_replication_config(port1, "node1", unique_topic_prefix, config_dir, mqtt_broker)
     
     server1 = None
     
     try:
         # Start server
-        server1 = await start_simple_server(config1)
+        server1 = await start_simple_server(merkle_binary, config1, port1)
         
-        # Wait for MQTT connections to stabilize
-        await asyncio.sleep(5)
-        
-        # Send a malformed message via MQTT
-        try:
-            def on_connect(client, userdata, flags, rc, properties=None):
-                if rc == 0:
-                    topic = f"{unique_topic_prefix}/events"
-                    
-                    # Send invalid JSON
-                    client.publish(topic, "invalid json message")
-                    
-                    # Send valid JSON but wrong format
-                    client.publish(topic, json.dumps({"invalid": "format"}))
-                    
-            client = mqtt.Client(protocol=mqtt.MQTTv5)
-            client.on_connect = on_connect
-            client.connect("test.mosquitto.org", 1883, 60)
-            client.loop_start()
+        topic = f"{unique_topic_prefix}/events"
+        async with MQTTTestClient(unique_topic_prefix, mqtt_monitor) as monitor:
+            # Wait for MQTT connections to stabilize
+            await wait_for_publishing(port1, monitor)
             
-            # Wait a bit
-            await asyncio.sleep(5)
+            # Send malformed messages via MQTT on one publisher connection
+            async with aiomqtt.Client(*mqtt_broker) as client:
+                # Send invalid JSON
+                await client.publish(topic, "invalid json message", qos=1)
+                
+                # Send valid JSON but wrong format
+                await client.publish(topic, json.dumps({"invalid": "format"}), qos=1)
             
-            client.loop_stop()
-            client.disconnect()
+            # The broker has fanned both out to the topic's subscribers; this
+            # does not show that the node has handled them yet
+            received = await monitor.wait_for_messages(2, timeout=5)
+            assert received >= 2, f"Broker delivered {received} of 2 malformed messages"
             
-            # Verify the node is still responsive
-            result = await execute_simple_command("127.0.0.1", 7397, "SET test_after_malformed success")
+            # Verify the node is still responsive and still replicating: the
+            # event for its next write must come back through the broker
+            result = await execute_simple_command("127.0.0.1", port1, "SET test_after_malformed success")
             assert result == "OK"
             
-            result = await execute_simple_command("127.0.0.1", 7397, "GET test_after_malformed")
-            assert result == "VALUE success"
-            
-            print("✅ Malformed message handling test passed")
-            
-        except Exception as e:
-            print(f"MQTT client error (expected in some cases): {e}")
+            published = await monitor.wait_for_messages(received + 1, timeout=5)
+            assert published > received, "Node published no event after the malformed messages"
+        
+        result = await execute_simple_command("127.0.0.1", port1, "GET test_after_malformed")
+        assert result == "VALUE success"
+        
+        print("✅ Malformed message handling test passed")
         
     finally:
         cleanup_servers(server1)
-        # Clean up config files
-        if config1.exists():
-            config1.unlink()
 
 if __name__ == "__main__":
     # Run specific test
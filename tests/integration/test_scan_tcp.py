@@ -1,43 +1,69 @@
 
 import pytest
-from conftest import MerkleKVClient
+from conftest import MerkleKVClient, MerkleKVServer, free_port
 
-class TestScanOverTcp:
-    def test_scan_basic(self, connected_client: MerkleKVClient):
-        # Clear data    
-        assert connected_client.send_command("TRUNCATE") == "OK"
+@pytest.fixture(scope="class")
+def scan_client(temp_test_dir, merkle_binary):
+    """Client for a server shared by the whole class, emptied once up front.
+
+    The datasets below load disjoint key prefixes, so tests can share the
+    server without clearing it between them.
+    """
+    port = free_port()
+    server = MerkleKVServer(port=port, binary=merkle_binary)
+    client = MerkleKVClient(port=port)
+    try:
+        server.start(temp_test_dir)
+        client.connect()
+        assert client.send_command("TRUNCATE") == "OK"
+        yield client
+    finally:
+        client.disconnect()
+        server.stop()
+
+@pytest.fixture(scope="class")
+def user_dataset(scan_client: MerkleKVClient) -> MerkleKVClient:
+    assert scan_client.send_command("MSET user:1 a user:2 b user:21 c") == "OK"
+    return scan_client
 
-        # Load sample data
-        assert connected_client.send_command("MSET user:1 a user:2 b user:21 c") == "OK"
+@pytest.fixture(scope="class")
+def proj_dataset(scan_client: MerkleKVClient) -> MerkleKVClient:
+    # Keys with special characters are still valid (except tab/newline)
+    assert scan_client.set("proj:αβγ", "1") == "OK"
+    assert scan_client.set("proj:αβδ", "2") == "OK"
+    assert scan_client.set("proj:xyz", "3") == "OK"
+    return scan_client
 
-        # SCAN "user:" 
-        keys = connected_client.scan("user:")
+@pytest.fixture(scope="class")
+def k_dataset(scan_client: MerkleKVClient) -> MerkleKVClient:
+    # Intentionally load nested prefix keys
+    assert scan_client.send_command("MSET k:1 a k:11 b k:111 c other z") == "OK"
+    return scan_client
+
+class TestScanOverTcp:
+    def test_scan_basic(self, user_dataset: MerkleKVClient):
+        # SCAN "user:"
+        keys = user_dataset.scan("user:")
         assert set(keys) == {"user:1", "user:2", "user:21"}
 
         # SCAN "user:2"
-        keys = connected_client.scan("user:2")
+        keys = user_dataset.scan("user:2")
         assert set(keys) == {"user:2", "user:21"}
 
         # SCAN "nosuch" -> empty
-        keys = connected_client.scan("nosuch")
+        keys = user_dataset.scan("nosuch")
         assert keys == []
 
 
 
-    def test_scan_is_one_argument(self, connected_client: MerkleKVClient):
+    def test_scan_is_one_argument(self, scan_client: MerkleKVClient):
 
         # Extra argument -> error
-        resp = connected_client.send_command("SCAN user: extra")
+        resp = scan_client.send_command("SCAN user: extra")
         assert "ERROR" in resp  # server: "ERROR SCAN command accepts only one argument"
 
-    def test_scan_special_characters(self, connected_client: MerkleKVClient):
-        assert connected_client.send_command("TRUNCATE") == "OK"
-        # Keys with special characters are still valid (except tab/newline)
-        assert connected_client.set("proj:αβγ", "1") == "OK"
-        assert connected_client.set("proj:αβδ", "2") == "OK"
-        assert connected_client.set("proj:xyz", "3") == "OK"
-
-        keys = connected_client.scan("proj:")
+    def test_scan_special_characters(self, proj_dataset: MerkleKVClient):
+        keys = proj_dataset.scan("proj:")
         # Order is not guaranteed -> compare as sets
         assert set(keys) == {"proj:αβγ", "proj:αβδ", "proj:xyz"}
 
@@ -50,9 +76,6 @@ class TestScanOverTcp:
             ("nope:", set()),
         ],
     )
-    def test_scan_parametrized(self, connected_client: MerkleKVClient, prefix, expected):
-        assert connected_client.send_command("TRUNCATE") == "OK"
-        # Intentionally load nested prefix keys
-        assert connected_client.send_command("MSET k:1 a k:11 b k:111 c other z") == "OK"
-        keys = connected_client.scan(prefix)
+    def test_scan_parametrized(self, k_dataset: MerkleKVClient, prefix, expected):
+        keys = k_dataset.scan(prefix)
         assert set(keys) == expected
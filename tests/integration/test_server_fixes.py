@@ -18,48 +18,91 @@ import subprocess
 import os
 import signal
 
+from conftest import PROJECT_ROOT, TEST_HOST, TEST_PORT, build_merkle_binary, wait_for_port
+
 
 class MerkleKVTestClient:
+    BUFFER_SIZE = 65536
+
     def __init__(self, host='127.0.0.1', port=7379):
         self.host = host
         self.port = port
         self.sock = None
+        # One receive buffer reused for every response: bytes between _r and
+        # _w have been received but not returned yet
+        self._buf = bytearray(self.BUFFER_SIZE)
+        self._mv = memoryview(self._buf)
+        self._r = 0
+        self._w = 0
 
     def connect(self):
         """Connect to the MerkleKV server"""
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._r = self._w = 0
 
     def disconnect(self):
         """Close the connection"""
         if self.sock:
             self.sock.close()
             self.sock = None
+        self._r = self._w = 0
+
+    def _make_room(self):
+        """Move unread bytes to the front of the buffer, growing it when full"""
+        pending = self._w - self._r
+        if self._r == 0:
+            # Full of one unfinished response: double the buffer
+            self._mv.release()
+            self._buf.extend(bytes(len(self._buf)))
+            self._mv = memoryview(self._buf)
+        else:
+            self._buf[:pending] = self._mv[self._r:self._w]
+            self._r, self._w = 0, pending
 
     def send_command(self, command):
         """Send a command and return the response"""
+        return self.send_command_raw(command).decode('utf-8')
+
+    def send_command_raw(self, command):
+        """Send a command (str or bytes) and return the undecoded response without its CRLF"""
         if not self.sock:
             self.connect()
         
         # Send command with CRLF termination
-        full_command = command + '\r\n'
-        self.sock.sendall(full_command.encode('utf-8'))
-        
-        # Read response until CRLF
-        response = b''
+        if isinstance(command, str):
+            command = command.encode('utf-8')
+        self.sock.sendall(command + b'\r\n')
+        return self._read_response()
+
+    def _read_response(self):
+        """Return the next CRLF-terminated response as bytes"""
+        # Read response until CRLF straight into the reusable buffer, only
+        # searching the bytes not scanned yet so large values stay linear
+        scan_from = self._r
         while True:
-            chunk = self.sock.recv(4096)
-            if not chunk:
+            end_idx = self._buf.find(b'\r\n', scan_from, self._w)
+            if end_idx != -1:
                 break
-            response += chunk
-            if b'\r\n' in response:
-                # Find the first complete response
-                end_idx = response.find(b'\r\n') + 2
-                response = response[:end_idx]
+            # A CR at the end of the data may pair with the next chunk's LF
+            scan_from = max(self._r, self._w - 1)
+            if self._w == len(self._buf):
+                scan_from -= self._r
+                self._make_room()
+            n = self.sock.recv_into(self._mv[self._w:])
+            if not n:
+                # Connection closed: return whatever arrived
+                end_idx = self._w
                 break
+            self._w += n
         
-        # Decode and strip CRLF
-        return response.decode('utf-8').rstrip('\r\n')
+        response = bytes(self._mv[self._r:end_idx])
+        # Skip past the CRLF; rewind to the start once everything is consumed
+        self._r = min(end_idx + 2, self._w)
+        if self._r == self._w:
+            self._r = self._w = 0
+        return response
 
     def set(self, key, value):
         """SET command"""
@@ -80,33 +123,31 @@ class MerkleKVTestClient:
         return self.send_command('PING')
 
 
-def start_server():
-    """Start MerkleKV server in background"""
+def start_server(merkle_binary=None):
+    """Start MerkleKV server in background from the release binary"""
     print("Starting MerkleKV server...")
     
-    # Change to the project directory
-    os.chdir('/workspaces/MerkleKV')
-    
-    # Build the project first
-    build_result = subprocess.run(['cargo', 'build', '--release'], 
-                                capture_output=True, text=True)
-    if build_result.returncode != 0:
-        print(f"Build failed: {build_result.stderr}")
-        sys.exit(1)
+    # Build the project unless a prebuilt binary was given
+    if merkle_binary is None:
+        try:
+            merkle_binary = build_merkle_binary()
+        except subprocess.CalledProcessError as e:
+            print(f"Build failed: {e}")
+            sys.exit(1)
     
     # Start the server
     server_process = subprocess.Popen(
-        ['./target/release/merkle_kv'],
+        [str(merkle_binary)],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        preexec_fn=os.setsid  # Create a new process group
+        cwd=PROJECT_ROOT,
+        start_new_session=True  # Create a new process group
     )
     
-    # Wait for server to start
-    time.sleep(5)
-    
-    # Check if process is still running
-    if server_process.poll() is not None:
+    # Wait until the server accepts connections
+    if not wait_for_port(TEST_HOST, TEST_PORT, timeout=20, process=server_process):
+        if server_process.poll() is None:
+            os.killpg(os.getpgid(server_process.pid), signal.SIGTERM)
         stdout, stderr = server_process.communicate()
         print(f"Server failed to start. stdout: {stdout.decode()}, stderr: {stderr.decode()}")
         sys.exit(1)
@@ -123,20 +164,22 @@ def test_large_values():
     # Test progressively larger values
     test_sizes = [500, 1024, 2048, 4096, 8192]  # bytes
     
+    # Build the largest payload once; every size is a prefix of it
+    payload = b'A' * max(test_sizes)
+    
     for size in test_sizes:
         print(f"Testing {size} byte value...")
         
-        # Create a large value
-        large_value = 'A' * size
+        large_value = payload[:size]
         key = f'large_key_{size}'
         
         # SET the large value
-        response = client.set(key, large_value)
-        assert response == 'OK', f"Expected 'OK' for SET, got '{response}'"
+        response = client.send_command_raw(b'SET ' + key.encode() + b' ' + large_value)
+        assert response == b'OK', f"Expected 'OK' for SET, got '{response}'"
         
-        # GET the large value back
-        response = client.get(key)
-        expected = f'VALUE {large_value}'
+        # GET the large value back, comparing bytes so the value is not decoded
+        response = client.send_command_raw(f'GET {key}')
+        expected = b'VALUE ' + large_value
         assert response == expected, f"Large value corrupted! Expected length {len(expected)}, got length {len(response)}"
         
         print(f"✓ {size} byte value handled correctly")
@@ -275,9 +318,6 @@ def run_all_tests():
     server_process = start_server()
     
     try:
-        # Wait a bit more for server to be ready
-        time.sleep(2)
-        
         # Test connection with retry
         max_retries = 5
         for attempt in range(max_retries):
@@ -317,7 +357,13 @@ def run_all_tests():
             os.killpg(os.getpgid(server_process.pid), signal.SIGTERM)
         except (ProcessLookupError, AttributeError):
             server_process.terminate()
-        server_process.wait(timeout=5)
+        # Drain the output pipes while waiting so a chatty server cannot block,
+        # and kill it after a short grace period
+        try:
+            server_process.communicate(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            server_process.kill()
+            server_process.communicate()
 
 
 if __name__ == '__main__':
@@ -6,20 +6,65 @@ that provide monitoring and diagnostic information.
 """
 
 import pytest
+import re
 import time
-from conftest import send_command, connect_to_server
+from conftest import MerkleKVServer, connect_to_server, free_port, send_command, send_pipeline
 
 
-def test_ping_command(server):
+def _parse_kv(response: str) -> dict[str, str]:
+    """Parse a STATS/INFO response into a dict, skipping its header line."""
+    lines = iter(response.splitlines())
+    next(lines, None)
+    return dict(line.split(":", 1) for line in lines if ":" in line)
+
+
+_FIELD_PATTERNS: dict[str, re.Pattern] = {}
+
+
+def _get_field(response: str, field: str) -> str:
+    """Return one field of a STATS/INFO response without parsing the rest."""
+    pattern = _FIELD_PATTERNS.get(field)
+    if pattern is None:
+        pattern = _FIELD_PATTERNS[field] = re.compile(rf"(?m)^{re.escape(field)}:(.*?)\r?$")
+    match = pattern.search(response)
+    if match is None:
+        raise KeyError(field)
+    return match.group(1)
+
+
+@pytest.fixture(scope="module")
+def stats_server(temp_test_dir, merkle_binary):
+    """One server shared by every test in this module.
+
+    The tests only compare counters against earlier readings, so they do not
+    need an empty store; the one that counts keys asks for ``clean_db``.
+    """
+    server = MerkleKVServer(port=free_port(), binary=merkle_binary)
+    try:
+        server.start(temp_test_dir)
+        yield server
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def clean_db(stats_server):
+    """The shared server with every key removed."""
+    with connect_to_server(port=stats_server.port) as client:
+        assert send_command(client, "TRUNCATE") == "OK"
+    return stats_server
+
+
+def test_ping_command(stats_server):
     """Test the PING command returns PONG."""
-    with connect_to_server() as client:
+    with connect_to_server(port=stats_server.port) as client:
         response = send_command(client, "PING")
         assert response == "PONG"
 
 
-def test_stats_command(server):
+def test_stats_command(stats_server):
     """Test the STATS command returns server statistics."""
-    with connect_to_server() as client:
+    with connect_to_server(port=stats_server.port) as client:
         # First, perform some operations to generate statistics
         send_command(client, "SET key1 value1")
         send_command(client, "GET key1")
@@ -31,13 +76,7 @@ def test_stats_command(server):
         # Verify the response starts with STATS
         assert response.startswith("STATS")
         
-        # Convert the response to a dictionary for easier checking
-        stats_lines = response.strip().split("\r\n")[1:]  # Skip the "STATS" line
-        stats = {}
-        for line in stats_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                stats[key] = value
+        stats = _parse_kv(response)
         
         # Check that essential statistics are present
         assert "uptime_seconds" in stats
@@ -54,21 +93,15 @@ def test_stats_command(server):
         assert int(stats["numeric_commands"]) >= 1  # We did at least one INC
 
 
-def test_info_command(server):
+def test_info_command(stats_server):
     """Test the INFO command returns server information."""
-    with connect_to_server() as client:
+    with connect_to_server(port=stats_server.port) as client:
         response = send_command(client, "INFO")
         
         # Verify the response starts with INFO
         assert response.startswith("INFO")
         
-        # Convert the response to a dictionary for easier checking
-        info_lines = response.strip().split("\r\n")[1:]  # Skip the "INFO" line
-        info = {}
-        for line in info_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                info[key] = value
+        info = _parse_kv(response)
         
         # Check that essential information is present
         assert "version" in info
@@ -78,39 +111,27 @@ def test_info_command(server):
         assert "db_keys" in info
 
 
-def test_stats_updates_with_commands(server):
+def test_stats_updates_with_commands(stats_server):
     """Test that the STATS command reflects command execution counts."""
-    with connect_to_server() as client:
+    with connect_to_server(port=stats_server.port) as client:
         # Get initial stats
         response = send_command(client, "STATS")
-        initial_stats_lines = response.strip().split("\r\n")[1:]
-        initial_stats = {}
-        for line in initial_stats_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                initial_stats[key] = value
+        initial_stats = _parse_kv(response)
         
         # Execute a series of commands
         num_gets = 3
         num_sets = 2
         num_deletes = 1
         
-        for i in range(num_sets):
-            send_command(client, f"SET key{i} value{i}")
-        
-        for i in range(num_gets):
-            send_command(client, f"GET key{i % num_sets}")
-        
-        send_command(client, "DELETE key0")
+        send_pipeline(client, [
+            *(f"SET key{i} value{i}" for i in range(num_sets)),
+            *(f"GET key{i % num_sets}" for i in range(num_gets)),
+            "DELETE key0",
+        ])
         
         # Get updated stats
         response = send_command(client, "STATS")
-        updated_stats_lines = response.strip().split("\r\n")[1:]
-        updated_stats = {}
-        for line in updated_stats_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                updated_stats[key] = value
+        updated_stats = _parse_kv(response)
         
         # Verify command counts increased by the expected amount
         assert int(updated_stats["get_commands"]) >= int(initial_stats.get("get_commands", "0")) + num_gets
@@ -118,69 +139,37 @@ def test_stats_updates_with_commands(server):
         assert int(updated_stats["delete_commands"]) >= int(initial_stats.get("delete_commands", "0")) + num_deletes
 
 
-def test_info_shows_key_count(server):
+def test_info_shows_key_count(clean_db):
     """Test that the INFO command shows the correct number of keys."""
-    with connect_to_server() as client:
-        # Clear any existing keys
-        send_command(client, "TRUNCATE")
-        
+    with connect_to_server(port=clean_db.port) as client:
         # Add a known number of keys
         num_keys = 5
-        for i in range(num_keys):
-            send_command(client, f"SET key{i} value{i}")
+        assert send_pipeline(client, [f"SET key{i} value{i}" for i in range(num_keys)]) == ["OK"] * num_keys
         
         # Get INFO and check key count
         response = send_command(client, "INFO")
-        info_lines = response.strip().split("\r\n")[1:]
-        info = {}
-        for line in info_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                info[key] = value
-        
-        assert int(info["db_keys"]) == num_keys
+        assert int(_get_field(response, "db_keys")) == num_keys
         
         # Delete a key and verify count decreases
         send_command(client, "DELETE key0")
         
         response = send_command(client, "INFO")
-        info_lines = response.strip().split("\r\n")[1:]
-        info = {}
-        for line in info_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                info[key] = value
-        
-        assert int(info["db_keys"]) == num_keys - 1
+        assert int(_get_field(response, "db_keys")) == num_keys - 1
 
 
-def test_uptime_increases(server):
+def test_uptime_increases(stats_server):
     """Test that the uptime reported by STATS and INFO increases over time."""
-    with connect_to_server() as client:
+    with connect_to_server(port=stats_server.port) as client:
         # Get initial uptime
         response = send_command(client, "STATS")
-        stats_lines = response.strip().split("\r\n")[1:]
-        stats = {}
-        for line in stats_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                stats[key] = value
-        
-        initial_uptime = int(stats["uptime_seconds"])
+        initial_uptime = int(_get_field(response, "uptime_seconds"))
         
         # Wait a short time
         time.sleep(2)
         
         # Get updated uptime
         response = send_command(client, "STATS")
-        stats_lines = response.strip().split("\r\n")[1:]
-        stats = {}
-        for line in stats_lines:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                stats[key] = value
-        
-        updated_uptime = int(stats["uptime_seconds"])
+        updated_uptime = int(_get_field(response, "uptime_seconds"))
         
         # Verify uptime increased
         assert updated_uptime >= initial_uptime + 1  # Allow for some timing variance
@@ -6,12 +6,14 @@ Test that verifies server storage persistence across restarts using sled.
 import asyncio
 import pytest
 import subprocess
-import time
 from pathlib import Path
-import toml
 import os
 import signal
 import shutil
+import tempfile
+
+from _config import STANDALONE_CONFIG_TEMPLATE
+from conftest import PROJECT_ROOT, PersistentClient, wait_for_port
 
 def create_persistence_config(port: int, node_id: str) -> Path:
     """Create a flat config file for sled persistence (no replication)."""
@@ -19,80 +21,50 @@ def create_persistence_config(port: int, node_id: str) -> Path:
     storage_path = Path("target/test_data_persistence")
     storage_path.mkdir(parents=True, exist_ok=True)
 
-    config = {
-        "host": "127.0.0.1",
-        "port": port,
-        "storage_path": str(storage_path),
-        "engine": "sled",
-        "sync_interval_seconds": 60,
-        "replication": {
-            "enabled": False,
-            "mqtt_broker": "localhost",
-            "mqtt_port": 1883,
-            "topic_prefix": "merkle_kv",
-            "client_id": node_id,
-        },
-    }
-
-    temp_config = Path(f"/tmp/test_config_persistence_{node_id}_{port}.toml")
-    with open(temp_config, "w") as f:
-        toml.dump(config, f)
+    # Honors TMPDIR, which is usually tmpfs on CI runners
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".toml", delete=False,
+                                     prefix=f"test_config_persistence_{node_id}_{port}_") as f:
+        f.write(STANDALONE_CONFIG_TEMPLATE.format(
+            port=port,
+            storage_path=storage_path,
+            engine="sled",
+            topic_prefix="merkle_kv",
+            node_id=node_id,
+        ))
+        # The server is restarted against this file, so make it durable
         f.flush()
         os.fsync(f.fileno())
 
-    return temp_config
+    return Path(f.name)
 
 
-async def start_server_with_config(config_path: Path, port: int, timeout: int = 30) -> subprocess.Popen:
-    """Start the server with the given config and wait until ready."""
-    cmd = ["cargo", "run", "--", "--config", str(config_path)]
+async def start_server_with_config(merkle_binary: Path, config_path: Path, port: int,
+                                   timeout: int = 30) -> subprocess.Popen:
+    """Start the prebuilt ``merkle_binary`` with the given config and wait until ready."""
+    cmd = [str(merkle_binary), "--config", str(config_path)]
     print(f"Starting server: {' '.join(cmd)}")
 
-    project_root = Path.cwd()
-    if "tests" in str(project_root):
-        project_root = project_root.parent.parent
-
     process = subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        cwd=project_root,  # ensure relative paths match manual run
+        cwd=PROJECT_ROOT,  # ensure relative paths match manual run
         env={**os.environ, "RUST_LOG": "info"}
     )
 
-    import socket
-    start_time = time.time()
-    while time.time() - start_time < timeout:
+    if not await asyncio.to_thread(wait_for_port, "127.0.0.1", port, timeout, process=process):
         if process.poll() is not None:
             stdout, stderr = process.communicate()
             raise RuntimeError(f"Server failed to start:\n{stdout.decode()}\n{stderr.decode()}")
+        process.send_signal(signal.SIGINT)
+        raise TimeoutError(f"Server failed to start within {timeout} seconds")
 
-        try:
-            with socket.create_connection(("127.0.0.1", port), timeout=1):
-                print(f"✅ Server started on port {port}")
-                return process
-        except (socket.timeout, ConnectionRefusedError):
-            await asyncio.sleep(0.2)
-
-    process.send_signal(signal.SIGINT)
-    raise TimeoutError(f"Server failed to start within {timeout} seconds")
-
-
-async def execute_command(host: str, port: int, command: str) -> str:
-    """Send a command to the server."""
-    reader, writer = await asyncio.open_connection(host, port)
-    try:
-        writer.write(f"{command}\r\n".encode())
-        await writer.drain()
-        data = await reader.read(1024)
-        return data.decode().strip()
-    finally:
-        writer.close()
-        await writer.wait_closed()
+    print(f"✅ Server started on port {port}")
+    return process
 
 
 @pytest.mark.asyncio
-async def test_storage_persistence_across_restart():
+async def test_storage_persistence_across_restart(merkle_binary):
     """Verify that data persists after server restart."""
     port = 7379
     node_id = "persistence_node"
@@ -103,11 +75,12 @@ async def test_storage_persistence_across_restart():
     try:
         # --- First startup ---
         print("🔹 Starting server first time...")
-        server = await start_server_with_config(config, port)
+        server = await start_server_with_config(merkle_binary, config, port)
         await asyncio.sleep(1)
 
         # Write key
-        result = await execute_command("127.0.0.1", port, "SET persist_key persist_value")
+        async with PersistentClient("127.0.0.1", port) as client:
+            result = await client.execute_command("SET persist_key persist_value")
         print(f"SET result: {result}")
         assert result == "OK"
 
@@ -126,11 +99,12 @@ async def test_storage_persistence_across_restart():
 
         # --- Restart ---
         print("🔹 Restarting server...")
-        server = await start_server_with_config(config, port)
+        server = await start_server_with_config(merkle_binary, config, port)
         await asyncio.sleep(1)
 
         # Check that key still exists
-        result = await execute_command("127.0.0.1", port, "GET persist_key")
+        async with PersistentClient("127.0.0.1", port) as client:
+            result = await client.execute_command("GET persist_key")
         print(f"GET after restart result: {result}")
         assert result == "VALUE persist_value"
 